@@ -1,10 +1,15 @@
 import json
+import os
+import secrets
+import tempfile
 from pathlib import Path
 from enum import Enum
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 
 from models import (
@@ -17,9 +22,11 @@ from models import (
     XPResponse,
 )
 
-from gemini_client import generate_daily_meal_plan, generate_weekly_meal_plan
+from gemini_client import generate_daily_meal_plan, generate_weekly_meal_plan, GeminiBudgetExhausted
+from rate_limit import allow_request, gemini_usage
+from export import iter_xp_rows, iter_csv, write_parquet, parse_watermark
+from storage import WriteBehindQueue
 from dotenv import load_dotenv
-import os
 
 load_dotenv()
 
@@ -30,6 +37,9 @@ if not GEMINI_API_KEY:
 import google.generativeai as genai
 genai.configure(api_key = GEMINI_API_KEY)
 
+# /api/admin/* routes need this in the X-Admin-Token header. Unset = admin routes disabled.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
 # ---------- FastAPI app + CORS ----------
 
 app = FastAPI()
@@ -74,6 +84,11 @@ class GoalType(str, Enum):
     maintenance = "maintenance"
 
 
+class ExportFormat(str, Enum):
+    csv = "csv"
+    parquet = "parquet"
+
+
 # ---------- Models ----------
 
 class OnboardingRequest(BaseModel):
@@ -158,16 +173,27 @@ def load_state() -> None:
 
 
 def save_state() -> None:
-    """Save user_profiles and user_xp_log to state.json."""
-    try:
-        data = {
-            "user_profiles": user_profiles,
-            "user_xp_log": user_xp_log,
-        }
-        with STATE_FILE.open("w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
-    except Exception as e:
-        print("Failed to save state.json:", e)
+    """Save user_profiles and user_xp_log to state.json. Raises on failure."""
+    # Snapshot first: this runs on the writer thread while handlers keep mutating.
+    data = {
+        "user_profiles": {k: dict(v) for k, v in list(user_profiles.items())},
+        "user_xp_log": {k: dict(v) for k, v in list(user_xp_log.items())},
+    }
+    tmp_file = STATE_FILE.with_name(STATE_FILE.name + ".tmp")
+    with tmp_file.open("w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    tmp_file.replace(STATE_FILE)
+
+
+# Saves happen in the background, at most PERSIST_MAX_DELAY_SEC after a change.
+# Set PERSIST_STRICT=1 to save before every response instead; if that save fails
+# the change is rolled back and the request returns 500, so retrying is safe.
+persistence = WriteBehindQueue(
+    save_state,
+    max_delay_sec=float(os.getenv("PERSIST_MAX_DELAY_SEC", "1.0")),
+    strict=os.getenv("PERSIST_STRICT", "").lower() in ("1", "true", "yes"),
+)
+
 # ---------- Helper functions ----------
 
 def calculate_maintenance_calories(req: OnboardingRequest) -> int:
@@ -218,6 +244,33 @@ def get_calorie_offset(goal_type: GoalType, level: ChallengeLevel) -> int:
         return +400
     return +600
 
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN not set).")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Missing or invalid admin token.")
+
+def enforce_rate_limit(user_id: str, route: str) -> None:
+    if not allow_request(user_id, route):
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests. Please wait a bit before trying again.",
+        )
+
+def budget_exhausted_error(e: GeminiBudgetExhausted) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Meal plans are temporarily unavailable. Please try again later.",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+def save_failed_error(e: Exception) -> HTTPException:
+    print("Failed to save state.json:", e)
+    return HTTPException(
+        status_code=500,
+        detail="Could not save your progress, nothing was recorded. Please try again.",
+    )
+
 def add_xp(user_id: str, date: str, base_xp: int) -> XPResponse:
     profile = user_profiles.get(user_id)
     if not profile:
@@ -232,8 +285,18 @@ def add_xp(user_id: str, date: str, base_xp: int) -> XPResponse:
     # update daily log
     if user_id not in user_xp_log:
         user_xp_log[user_id] = {}
-    user_xp_log[user_id][date] = user_xp_log[user_id].get(date, 0) + xp_earned
-    save_state()
+    day_log = user_xp_log[user_id]
+    day_log[date] = day_log.get(date, 0) + xp_earned
+
+    try:
+        persistence.enqueue()
+    except Exception as e:
+        # strict mode: undo by subtracting so concurrent requests for this user aren't lost
+        profile["total_xp"] -= xp_earned
+        day_log[date] -= xp_earned
+        if day_log[date] == 0:
+            day_log.pop(date)
+        raise save_failed_error(e)
 
     return XPResponse(
         user_id=user_id,
@@ -264,11 +327,12 @@ def calculate_walk_xp(duration_minutes: int, distance_km: float, is_outdoor: boo
 def on_startup():
     load_state()
     print("Loaded state from state.json (if it existed).")
+    persistence.start()
 
 @app.on_event("shutdown")
 def on_shutdown():
-    save_state()
-    print("Saved state to state.json on shutdown.")
+    if persistence.stop():
+        print("Saved state to state.json on shutdown.")
 
 
 @app.get("/health")
@@ -276,6 +340,57 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/api/admin/gemini-usage", dependencies=[Depends(require_admin)])
+def gemini_usage_today():
+    return gemini_usage()
+
+
+@app.get("/api/admin/persistence", dependencies=[Depends(require_admin)])
+def persistence_metrics():
+    return persistence.metrics()
+
+
+@app.get("/api/admin/export/xp", dependencies=[Depends(require_admin)])
+def export_xp(
+    export_format: ExportFormat = Query(ExportFormat.csv, alias="format"),
+    since: Optional[str] = None,
+):
+    """
+    Export XP history as user_id, date, xp, challenge_level, diet_type.
+    Pass `since` (YYYY-MM-DD) to only get dates after that watermark.
+    """
+    try:
+        since = parse_watermark(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since must be a YYYY-MM-DD date.")
+
+    rows = iter_xp_rows(user_profiles, user_xp_log, since=since)
+
+    if export_format == ExportFormat.csv:
+        return StreamingResponse(
+            iter_csv(rows),
+            media_type="text/csv",
+            headers={"Content-Disposition": "attachment; filename=xp_history.csv"},
+        )
+
+    fd, tmp_path = tempfile.mkstemp(suffix=".parquet")
+    os.close(fd)
+    try:
+        write_parquet(rows, Path(tmp_path))
+    except RuntimeError as e:
+        os.remove(tmp_path)
+        raise HTTPException(status_code=501, detail=str(e))
+    except Exception as e:
+        os.remove(tmp_path)
+        raise HTTPException(status_code=500, detail=f"Failed to write Parquet export. Error: {e}")
+    return FileResponse(
+        tmp_path,
+        media_type="application/octet-stream",
+        filename="xp_history.parquet",
+        background=BackgroundTask(os.remove, tmp_path),
+    )
+
+
 @app.post("/api/onboarding", response_model=OnboardingResponse)
 def onboarding(req: OnboardingRequest):
     maintenance = calculate_maintenance_calories(req)
@@ -286,6 +401,7 @@ def onboarding(req: OnboardingRequest):
     xp_mult = get_xp_multiplier(req.challenge_level)
 
     # Store full profile for later use (e.g., meal plans, XP, etc.)
+    previous_profile = user_profiles.get(req.user_id)
     user_profiles[req.user_id] = {
         "user_id": req.user_id,
         "challenge_level": req.challenge_level.value,
@@ -303,7 +419,16 @@ def onboarding(req: OnboardingRequest):
         "xp_multiplier": xp_mult,
         "total_xp": 0,
     }
-    save_state()
+
+    try:
+        persistence.enqueue()
+    except Exception as e:
+        # strict mode: put back whatever was there before
+        if previous_profile is None:
+            user_profiles.pop(req.user_id, None)
+        else:
+            user_profiles[req.user_id] = previous_profile
+        raise save_failed_error(e)
 
     msg = (
         f"You're set up for a {req.challenge_level.value} challenge with "
@@ -334,15 +459,19 @@ def daily_meal_plan(req: DailyMealPlanRequest):
             status_code=404,
             detail="User not found. Complete onboarding first.",
         )
+    enforce_rate_limit(req.user_id, "mealplan_daily")
 
     target = profile["target_calories"]
 
-    meal_data_raw = generate_daily_meal_plan(
-        target_calories=target,
-        goal=profile["goal_type"],
-        diet=profile["diet_type"],
-        meals_per_day=profile["preferred_meals_per_day"]
-    )
+    try:
+        meal_data_raw = generate_daily_meal_plan(
+            target_calories=target,
+            goal=profile["goal_type"],
+            diet=profile["diet_type"],
+            meals_per_day=profile["preferred_meals_per_day"]
+        )
+    except GeminiBudgetExhausted as e:
+        raise budget_exhausted_error(e)
 
     # Check if the client failed and returned a dict instead of a string
     if isinstance(meal_data_raw, dict):
@@ -375,18 +504,22 @@ def weekly_meal_plan(req: WeeklyMealPlanRequest):
     profile = user_profiles.get(req.user_id)
     if not profile:
         raise HTTPException(status_code=404, detail="User not found. Complete onboarding first.")
+    enforce_rate_limit(req.user_id, "mealplan_week")
 
     if not (1 <= req.week_number <= 11):
         raise HTTPException(status_code=400, detail="week_number must be between 1 and 11.")
 
     target = profile["target_calories"]
 
-    week_plan_data_raw = generate_weekly_meal_plan(
-        target_calories=target,
-        goal=profile["goal_type"],
-        diet=profile["diet_type"],
-        meals_per_day=profile["preferred_meals_per_day"]
-    )
+    try:
+        week_plan_data_raw = generate_weekly_meal_plan(
+            target_calories=target,
+            goal=profile["goal_type"],
+            diet=profile["diet_type"],
+            meals_per_day=profile["preferred_meals_per_day"]
+        )
+    except GeminiBudgetExhausted as e:
+        raise budget_exhausted_error(e)
 
     if isinstance(week_plan_data_raw, dict):
         week_plan_data = week_plan_data_raw
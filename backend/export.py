@@ -0,0 +1,149 @@
+# backend/export.py
+"""
+Stream XP history out of the app state as CSV or Parquet.
+
+    python export.py --format csv --out xp.csv
+    python export.py --format parquet --out xp.parquet --since 2025-11-30
+"""
+import argparse
+import csv
+import io
+import json
+from datetime import date as Date
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # parquet export is optional
+    pa = None
+    pq = None
+
+EXPORT_COLUMNS = ["user_id", "date", "xp", "challenge_level", "diet_type"]
+DEFAULT_CHUNK_SIZE = 10_000
+
+
+def parse_watermark(value: Optional[str]) -> Optional[str]:
+    """Normalise a --since / ?since= value to YYYY-MM-DD. Raises ValueError if it isn't a date."""
+    if not value:
+        return None
+    return Date.fromisoformat(value).isoformat()
+
+
+def _watermark_arg(value: str) -> str:
+    try:
+        return parse_watermark(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a YYYY-MM-DD date: {value!r}")
+
+
+def _chunk_size_arg(value: str) -> int:
+    try:
+        size = int(value)
+    except ValueError:
+        size = 0
+    if size < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer: {value!r}")
+    return size
+
+
+def iter_xp_rows(
+    user_profiles: Dict[str, Dict[str, Any]],
+    user_xp_log: Dict[str, Dict[str, int]],
+    since: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield one row per (user, date) in user_xp_log.
+    If `since` ("YYYY-MM-DD") is given, only dates strictly after it are yielded.
+    """
+    # Copy the keys so requests mutating the log don't break iteration.
+    for user_id in list(user_xp_log.keys()):
+        days = user_xp_log.get(user_id) or {}
+        profile = user_profiles.get(user_id) or {}
+        for date in sorted(days.keys()):
+            if since and date <= since:
+                continue
+            yield {
+                "user_id": user_id,
+                "date": date,
+                "xp": days[date],
+                "challenge_level": profile.get("challenge_level"),
+                "diet_type": profile.get("diet_type"),
+            }
+
+
+def iter_chunks(rows: Iterator[Dict[str, Any]], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_csv(rows: Iterator[Dict[str, Any]], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+    """Yield CSV text (header first), one chunk of rows at a time."""
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    for chunk in iter_chunks(rows, chunk_size):
+        writer.writerows(chunk)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue()  # header only, no rows
+
+
+def write_csv(rows: Iterator[Dict[str, Any]], out_path: Path, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+    with out_path.open("w", encoding="utf-8", newline="") as f:
+        for text in iter_csv(rows, chunk_size):
+            f.write(text)
+
+
+def write_parquet(rows: Iterator[Dict[str, Any]], out_path: Path, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+    """Write one Parquet row group per chunk. Needs pyarrow."""
+    if pa is None:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow).")
+
+    schema = pa.schema([
+        ("user_id", pa.string()),
+        ("date", pa.string()),
+        ("xp", pa.int64()),
+        ("challenge_level", pa.string()),
+        ("diet_type", pa.string()),
+    ])
+    with pq.ParquetWriter(str(out_path), schema) as writer:
+        for chunk in iter_chunks(rows, chunk_size):
+            writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export XP history from state.json.")
+    parser.add_argument("--state", default="state.json", help="path to state.json")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--out", required=True, help="output file")
+    parser.add_argument("--since", type=_watermark_arg, help="only export dates after this YYYY-MM-DD watermark")
+    parser.add_argument("--chunk-size", type=_chunk_size_arg, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    with Path(args.state).open("r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    rows = iter_xp_rows(
+        data.get("user_profiles", {}) or {},
+        data.get("user_xp_log", {}) or {},
+        since=args.since,
+    )
+    out_path = Path(args.out)
+    if args.format == "parquet":
+        write_parquet(rows, out_path, args.chunk_size)
+    else:
+        write_csv(rows, out_path, args.chunk_size)
+    print(f"Exported XP history to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
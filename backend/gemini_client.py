@@ -2,8 +2,59 @@ import google.generativeai as genai
 import json
 from typing import List, Dict
 
+from rate_limit import (
+    reserve_gemini_request,
+    release_gemini_request,
+    record_gemini_tokens,
+    seconds_until_budget_reset,
+)
+
 model = genai.GenerativeModel("gemini-2.5-flash")
 
+# Last good plan per profile, served when the daily Gemini budget runs out.
+_plan_cache: Dict[tuple, str] = {}
+
+
+class GeminiBudgetExhausted(Exception):
+    """Daily Gemini budget is used up and there is no cached plan to fall back on."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Gemini budget exhausted, resets in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _generate(cache_key: tuple, prompt: str, generation_config: dict) -> str:
+    """Call Gemini within the global budget; falls back to the cached plan."""
+    reservation = reserve_gemini_request()
+    if reservation is None:
+        cached = _plan_cache.get(cache_key)
+        if cached is None:
+            raise GeminiBudgetExhausted(seconds_until_budget_reset())
+        print("Gemini budget exhausted, serving cached plan for", cache_key)
+        return cached
+
+    try:
+        response = model.generate_content(
+            prompt,
+            generation_config=generation_config,
+        )
+    except Exception:
+        release_gemini_request(reservation)
+        raise
+
+    # Gemini did the work even if .text raises below (e.g. a blocked response), so count it.
+    record_gemini_tokens(reservation, response)
+    text = response.text
+
+    # Only cache plans that parse; a truncated response would keep failing once served from cache.
+    try:
+        json.loads(text)
+        _plan_cache[cache_key] = text
+    except json.JSONDecodeError:
+        pass
+    return text
+
+
 def generate_daily_meal_plan(target_calories: int, goal: str, diet: str, meals_per_day: int = 3):
     schema = {
         "type": "object",
@@ -52,11 +103,9 @@ Do NOT include commentary, markdown, or any explanations.
     }
 
     try:
-        response = model.generate_content(
-            prompt,
-            generation_config=generation_config,
-        )
-        return response.text
+        return _generate(("daily", target_calories, goal, diet, meals_per_day), prompt, generation_config)
+    except GeminiBudgetExhausted:
+        raise
     except Exception as e:
         print("\n--- GEMINI API ERROR ---")
         print("Failed to generate structured content for daily meal plan. Error:", e)
@@ -127,11 +176,9 @@ Return JSON that matches the schema EXACTLY.
     }
 
     try:
-        response = model.generate_content(
-            prompt,
-            generation_config=generation_config,
-        )
-        return response.text
+        return _generate(("weekly", target_calories, goal, diet, meals_per_day), prompt, generation_config)
+    except GeminiBudgetExhausted:
+        raise
     except Exception as e:
         print("\n--- GEMINI WEEKLY API ERROR ---")
         print("Failed to generate structured content for weekly meal plan. Error:", e)
@@ -0,0 +1,225 @@
+# backend/rate_limit.py
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# app.py imports us (via gemini_client) before it calls load_dotenv itself.
+load_dotenv()
+
+# ---------- Config (from .env, same as GEMINI_API_KEY) ----------
+
+# Per user + route token bucket: burst size and refill speed.
+RATE_LIMIT_CAPACITY = float(os.getenv("RATE_LIMIT_CAPACITY", "5"))
+RATE_LIMIT_REFILL_PER_SEC = float(os.getenv("RATE_LIMIT_REFILL_PER_SEC", "0.1"))
+if RATE_LIMIT_REFILL_PER_SEC <= 0:
+    raise RuntimeError("RATE_LIMIT_REFILL_PER_SEC in .env must be greater than 0")
+
+# How often MemoryBackend drops buckets that have refilled completely.
+_BUCKET_PRUNE_INTERVAL_SEC = 60.0
+
+# Global Gemini budget per UTC day. 0 means "no limit".
+GEMINI_DAILY_TOKEN_BUDGET = int(os.getenv("GEMINI_DAILY_TOKEN_BUDGET", "1000000"))
+GEMINI_DAILY_REQUEST_BUDGET = int(os.getenv("GEMINI_DAILY_REQUEST_BUDGET", "1500"))
+
+# Set this to share buckets/budgets between uvicorn workers.
+REDIS_URL = os.getenv("REDIS_URL")
+
+
+# ---------- Backends ----------
+
+class MemoryBackend:
+    """Single-process backend. Fine for `uvicorn app:app --reload`."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, last_ts)
+        self._counters: Dict[str, int] = {}
+        self._last_prune = time.monotonic()
+
+    def take_token(self, key: str, capacity: float, refill_per_sec: float) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_prune >= _BUCKET_PRUNE_INTERVAL_SEC:
+                self._prune_buckets(now, capacity, refill_per_sec)
+            tokens, last = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * refill_per_sec)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            return allowed
+
+    def _prune_buckets(self, now: float, capacity: float, refill_per_sec: float) -> None:
+        # A full bucket behaves exactly like a missing one, so it's safe to drop.
+        self._buckets = {
+            key: (tokens, last)
+            for key, (tokens, last) in self._buckets.items()
+            if tokens + (now - last) * refill_per_sec < capacity
+        }
+        self._last_prune = now
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            return self._counters[key]
+
+    def get(self, key: str) -> int:
+        with self._lock:
+            return self._counters.get(key, 0)
+
+
+# Refill + take in one round trip so workers can't race each other.
+_TAKE_TOKEN_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return allowed
+"""
+
+
+class RedisBackend:
+    """Shared backend for multi-worker setups. Needs `pip install redis`."""
+
+    def __init__(self, url: str):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._redis.ping()  # fail fast so _make_backend can fall back
+        self._take_token = self._redis.register_script(_TAKE_TOKEN_LUA)
+
+    def take_token(self, key: str, capacity: float, refill_per_sec: float) -> bool:
+        return bool(self._take_token(keys=[key], args=[capacity, refill_per_sec, time.time()]))
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        pipe = self._redis.pipeline()
+        pipe.incrby(key, amount)
+        pipe.expire(key, 2 * 24 * 3600)  # daily keys, keep a little history
+        value, _ = pipe.execute()
+        return int(value)
+
+    def get(self, key: str) -> int:
+        return int(self._redis.get(key) or 0)
+
+
+def _make_backend():
+    if REDIS_URL:
+        try:
+            return RedisBackend(REDIS_URL)
+        except Exception as e:
+            print("Failed to connect to Redis, falling back to in-memory rate limits:", e)
+    return MemoryBackend()
+
+
+backend = _make_backend()
+
+# Used when the shared backend errors at runtime (e.g. Redis went away).
+_memory_fallback = backend if isinstance(backend, MemoryBackend) else MemoryBackend()
+
+
+def _call_backend(method: str, *args):
+    try:
+        return getattr(backend, method)(*args)
+    except Exception as e:
+        print("Rate limit backend error, using in-memory fallback:", e)
+        return getattr(_memory_fallback, method)(*args)
+
+
+# ---------- Per-user rate limiting ----------
+
+def allow_request(user_id: str, route: str) -> bool:
+    """Take one token from the (user_id, route) bucket. False means rate limited."""
+    return _call_backend(
+        "take_token",
+        f"ratelimit:{route}:{user_id}",
+        RATE_LIMIT_CAPACITY,
+        RATE_LIMIT_REFILL_PER_SEC,
+    )
+
+
+# ---------- Global Gemini quota ----------
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def seconds_until_budget_reset() -> int:
+    """Seconds until the daily Gemini budget resets (next UTC midnight)."""
+    now = datetime.now(timezone.utc)
+    midnight = datetime(now.year, now.month, now.day, tzinfo=timezone.utc) + timedelta(days=1)
+    return max(1, int((midnight - now).total_seconds()))
+
+
+# (backend, day) that holds a reservation, so release/record hit the same counters.
+Reservation = Tuple[Any, str]
+
+
+def _reserve_on(store, day: str) -> bool:
+    if GEMINI_DAILY_TOKEN_BUDGET and store.get(f"gemini:tokens:{day}") >= GEMINI_DAILY_TOKEN_BUDGET:
+        return False
+
+    # incr is atomic, so concurrent workers can't all squeeze past the limit.
+    requests = store.incr(f"gemini:requests:{day}", 1)
+    if GEMINI_DAILY_REQUEST_BUDGET and requests > GEMINI_DAILY_REQUEST_BUDGET:
+        store.incr(f"gemini:requests:{day}", -1)
+        return False
+    return True
+
+
+def reserve_gemini_request() -> Optional[Reservation]:
+    """
+    Claim one request from today's budget before calling Gemini.
+    Returns None (and claims nothing) once the request or token budget is used up;
+    otherwise pass the reservation to release_gemini_request / record_gemini_tokens.
+    """
+    day = _today()
+    try:
+        return (backend, day) if _reserve_on(backend, day) else None
+    except Exception as e:
+        print("Rate limit backend error, using in-memory fallback:", e)
+        return (_memory_fallback, day) if _reserve_on(_memory_fallback, day) else None
+
+
+def release_gemini_request(reservation: Reservation) -> None:
+    """Give back a reservation when the Gemini call failed."""
+    store, day = reservation
+    try:
+        store.incr(f"gemini:requests:{day}", -1)
+    except Exception as e:
+        print("Failed to release Gemini request reservation:", e)
+
+
+def record_gemini_tokens(reservation: Reservation, response) -> None:
+    """Add the tokens from response.usage_metadata. Never raises."""
+    store, day = reservation
+    try:
+        usage = getattr(response, "usage_metadata", None)
+        total_tokens = getattr(usage, "total_token_count", 0) or 0
+        if total_tokens:
+            store.incr(f"gemini:tokens:{day}", int(total_tokens))
+    except Exception as e:
+        print("Failed to record Gemini token usage:", e)
+
+
+def gemini_usage() -> Dict[str, int]:
+    day = _today()
+    return {
+        "requests": _call_backend("get", f"gemini:requests:{day}"),
+        "tokens": _call_backend("get", f"gemini:tokens:{day}"),
+        "request_budget": GEMINI_DAILY_REQUEST_BUDGET,
+        "token_budget": GEMINI_DAILY_TOKEN_BUDGET,
+    }
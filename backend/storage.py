@@ -0,0 +1,153 @@
+# backend/storage.py
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+# Retry delays after a failed background save: doubles from _MIN up to _MAX.
+_MIN_RETRY_BACKOFF_SEC = 0.5
+_MAX_RETRY_BACKOFF_SEC = 30.0
+
+
+class WriteBehindQueue:
+    """
+    Batches state saves off the request path.
+
+    Handlers call enqueue() after mutating state and return right away.
+    A background thread calls flush_fn once per batch, at most
+    max_delay_sec after the first unsaved mutation; failed saves are
+    kept queued and retried with backoff. In strict mode enqueue()
+    flushes synchronously and raises if the save fails.
+    """
+
+    def __init__(self, flush_fn: Callable[[], None], max_delay_sec: float = 1.0, strict: bool = False):
+        self.flush_fn = flush_fn
+        self.max_delay_sec = max_delay_sec
+        self.strict = strict
+
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # one writer to state.json at a time
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._pending = 0
+        self._first_pending_at: Optional[float] = None
+
+        # metrics
+        self.flush_count = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.failed_flush_count = 0
+        self.last_error: Optional[str] = None
+
+    def start(self) -> None:
+        if self.strict or self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="state-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> bool:
+        """Stop the worker after flushing everything still queued. False if that final save failed."""
+        if self._thread is not None:
+            with self._cond:
+                self._stopping = True
+                self._cond.notify()
+            self._thread.join()
+            self._thread = None
+
+        with self._cond:
+            batch = self._pending
+            self._pending = 0
+            self._first_pending_at = None
+        if batch:
+            try:
+                self._flush(batch)
+            except Exception as e:
+                print(f"Final save failed, {batch} change(s) not saved:", e)
+                return False
+        return True
+
+    def enqueue(self) -> None:
+        """Record one mutation that needs to be saved."""
+        if self.strict or self._thread is None:
+            self._flush(1)
+            return
+
+        with self._cond:
+            self._pending += 1
+            if self._first_pending_at is None:
+                self._first_pending_at = time.monotonic()
+            self._cond.notify()
+
+    def metrics(self) -> Dict[str, object]:
+        with self._cond:
+            queue_depth = self._pending
+            oldest = self._first_pending_at
+        return {
+            "mode": "strict" if self.strict else "write_behind",
+            "max_delay_sec": self.max_delay_sec,
+            "queue_depth": queue_depth,
+            "oldest_pending_sec": round(time.monotonic() - oldest, 3) if oldest else 0.0,
+            "flush_count": self.flush_count,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "failed_flush_count": self.failed_flush_count,
+            "last_error": self.last_error,
+        }
+
+    def _run(self) -> None:
+        backoff = 0.0
+        while True:
+            with self._cond:
+                while self._pending == 0 and not self._stopping:
+                    self._cond.wait()
+                if self._pending == 0:
+                    return  # stopping and nothing left
+
+                if backoff:
+                    deadline = time.monotonic() + backoff  # retrying a failed save
+                else:
+                    # Let more mutations pile up, but never past max_delay_sec.
+                    deadline = self._first_pending_at + self.max_delay_sec
+                while not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                batch = self._pending
+                first_pending_at = self._first_pending_at
+                self._pending = 0
+                self._first_pending_at = None
+
+            try:
+                self._flush(batch)
+                backoff = 0.0
+            except Exception as e:
+                print("Background save failed, will retry:", e)
+                with self._cond:
+                    # Put the batch back; its oldest change is still the oldest unsaved one.
+                    self._pending += batch
+                    self._first_pending_at = first_pending_at
+                if self._stopping:
+                    return  # stop() makes the final attempt
+                backoff = min(max(backoff * 2, _MIN_RETRY_BACKOFF_SEC), _MAX_RETRY_BACKOFF_SEC)
+
+    def _flush(self, batch: int) -> None:
+        """Run flush_fn once and record metrics. Re-raises if it fails."""
+        with self._flush_lock:
+            start = time.perf_counter()
+            try:
+                self.flush_fn()
+            except Exception as e:
+                self.failed_flush_count += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                raise
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            self.flush_count += 1
+            self.last_error = None
+            self.last_batch_size = batch
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
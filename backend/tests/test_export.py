@@ -0,0 +1,55 @@
+import argparse
+import csv
+import io
+
+import pytest
+
+import export
+
+PROFILES = {"ana": {"challenge_level": "hard", "diet_type": "vegan"}}
+XP_LOG = {
+    "ana": {"2025-11-02": 10, "2025-11-01": 5},
+    "ben": {"2025-11-03": 7},
+}
+
+
+def test_iter_xp_rows_yields_one_row_per_user_day():
+    rows = list(export.iter_xp_rows(PROFILES, XP_LOG))
+    assert rows == [
+        {"user_id": "ana", "date": "2025-11-01", "xp": 5, "challenge_level": "hard", "diet_type": "vegan"},
+        {"user_id": "ana", "date": "2025-11-02", "xp": 10, "challenge_level": "hard", "diet_type": "vegan"},
+        {"user_id": "ben", "date": "2025-11-03", "xp": 7, "challenge_level": None, "diet_type": None},
+    ]
+
+
+def test_iter_xp_rows_since_is_exclusive():
+    rows = list(export.iter_xp_rows(PROFILES, XP_LOG, since="2025-11-02"))
+    assert [(r["user_id"], r["date"]) for r in rows] == [("ben", "2025-11-03")]
+
+
+def test_iter_csv_chunks_and_round_trips():
+    chunks = list(export.iter_csv(export.iter_xp_rows(PROFILES, XP_LOG), chunk_size=2))
+    assert len(chunks) == 2
+
+    rows = list(csv.DictReader(io.StringIO("".join(chunks))))
+    assert [r["xp"] for r in rows] == ["5", "10", "7"]
+    assert list(rows[0].keys()) == export.EXPORT_COLUMNS
+
+
+def test_iter_csv_with_no_rows_still_writes_header():
+    assert "".join(export.iter_csv(iter([]))).strip() == ",".join(export.EXPORT_COLUMNS)
+
+
+def test_parse_watermark():
+    assert export.parse_watermark(None) is None
+    assert export.parse_watermark("2025-12-01") == "2025-12-01"
+    for bad in ["2025-12", "2025-1-5", "yesterday"]:
+        with pytest.raises(ValueError):
+            export.parse_watermark(bad)
+
+
+def test_chunk_size_must_be_positive():
+    assert export._chunk_size_arg("5") == 5
+    for bad in ["0", "-1", "abc"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            export._chunk_size_arg(bad)
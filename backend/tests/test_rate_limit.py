@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+import rate_limit
+
+
+class BrokenBackend:
+    """Stands in for a Redis backend whose connection has gone away."""
+
+    def __getattr__(self, name):
+        def fail(*args):
+            raise ConnectionError("redis down")
+        return fail
+
+
+@pytest.fixture(autouse=True)
+def fresh_backend(monkeypatch):
+    memory = rate_limit.MemoryBackend()
+    monkeypatch.setattr(rate_limit, "backend", memory)
+    monkeypatch.setattr(rate_limit, "_memory_fallback", memory)
+    monkeypatch.setattr(rate_limit, "GEMINI_DAILY_REQUEST_BUDGET", 2)
+    monkeypatch.setattr(rate_limit, "GEMINI_DAILY_TOKEN_BUDGET", 100)
+    return memory
+
+
+class FakeUsage:
+    def __init__(self, total_token_count):
+        self.total_token_count = total_token_count
+
+
+class FakeResponse:
+    def __init__(self, total_token_count):
+        self.usage_metadata = FakeUsage(total_token_count)
+
+
+def test_bucket_allows_burst_then_limits():
+    backend = rate_limit.MemoryBackend()
+    assert [backend.take_token("k", 2, 0.1) for _ in range(3)] == [True, True, False]
+    # other keys have their own bucket
+    assert backend.take_token("other", 2, 0.1)
+
+
+def test_bucket_refills_over_time(monkeypatch):
+    backend = rate_limit.MemoryBackend()
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+
+    assert backend.take_token("k", 1, 0.5)
+    assert not backend.take_token("k", 1, 0.5)
+    now[0] += 2.0
+    assert backend.take_token("k", 1, 0.5)
+
+
+def test_full_buckets_are_pruned(monkeypatch):
+    backend = rate_limit.MemoryBackend()
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+
+    backend.take_token("idle", 2, 1.0)
+    now[0] += rate_limit._BUCKET_PRUNE_INTERVAL_SEC
+    backend.take_token("busy", 2, 1.0)
+
+    assert set(backend._buckets) == {"busy"}
+
+
+def test_reserve_stops_at_request_budget():
+    assert rate_limit.reserve_gemini_request() is not None
+    assert rate_limit.reserve_gemini_request() is not None
+    assert rate_limit.reserve_gemini_request() is None
+    # the rejected reservation was backed out again
+    assert rate_limit.gemini_usage()["requests"] == 2
+
+
+def test_release_gives_the_request_back():
+    reservation = rate_limit.reserve_gemini_request()
+    rate_limit.release_gemini_request(reservation)
+    assert rate_limit.gemini_usage()["requests"] == 0
+
+
+def test_token_budget_blocks_new_reservations():
+    reservation = rate_limit.reserve_gemini_request()
+    rate_limit.record_gemini_tokens(reservation, FakeResponse(150))
+
+    assert rate_limit.gemini_usage()["tokens"] == 150
+    assert rate_limit.reserve_gemini_request() is None
+
+
+def test_record_tokens_ignores_missing_usage_metadata():
+    reservation = rate_limit.reserve_gemini_request()
+    rate_limit.record_gemini_tokens(reservation, object())
+    assert rate_limit.gemini_usage()["tokens"] == 0
+
+
+def test_backend_errors_fall_back_to_memory(monkeypatch, fresh_backend):
+    monkeypatch.setattr(rate_limit, "backend", BrokenBackend())
+
+    assert rate_limit.allow_request("user", "route")
+    reservation = rate_limit.reserve_gemini_request()
+    assert reservation[0] is fresh_backend
+
+    # release goes to the same backend that took the reservation
+    rate_limit.release_gemini_request(reservation)
+    assert fresh_backend.get(f"gemini:requests:{reservation[1]}") == 0
+
+
+def test_seconds_until_budget_reset_is_within_a_day():
+    assert 1 <= rate_limit.seconds_until_budget_reset() <= 24 * 3600
@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+import storage
+
+
+class FlakyWriter:
+    def __init__(self):
+        self.fail = False
+        self.calls = 0
+
+    def __call__(self):
+        if self.fail:
+            raise OSError("disk full")
+        self.calls += 1
+
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(storage, "_MIN_RETRY_BACKOFF_SEC", 0.05)
+
+
+def test_mutations_are_batched_into_one_flush():
+    writer = FlakyWriter()
+    queue = storage.WriteBehindQueue(writer, max_delay_sec=0.1)
+    queue.start()
+    for _ in range(20):
+        queue.enqueue()
+
+    assert queue.metrics()["queue_depth"] == 20
+    assert wait_for(lambda: queue.metrics()["flush_count"] == 1)
+    assert writer.calls == 1
+    assert queue.metrics()["last_batch_size"] == 20
+    queue.stop()
+
+
+def test_failed_flush_is_requeued_and_retried():
+    writer = FlakyWriter()
+    writer.fail = True
+    queue = storage.WriteBehindQueue(writer, max_delay_sec=0.05)
+    queue.start()
+    for _ in range(5):
+        queue.enqueue()
+
+    assert wait_for(lambda: queue.metrics()["failed_flush_count"] >= 1)
+    metrics = queue.metrics()
+    assert metrics["queue_depth"] == 5
+    assert metrics["flush_count"] == 0
+    assert metrics["last_error"] == "OSError: disk full"
+
+    writer.fail = False
+    assert wait_for(lambda: queue.metrics()["flush_count"] == 1)
+    metrics = queue.metrics()
+    assert metrics["queue_depth"] == 0
+    assert metrics["last_batch_size"] == 5
+    assert metrics["last_error"] is None
+    queue.stop()
+
+
+def test_stop_drains_the_queue():
+    writer = FlakyWriter()
+    queue = storage.WriteBehindQueue(writer, max_delay_sec=60)
+    queue.start()
+    queue.enqueue()
+
+    assert queue.stop() is True
+    assert writer.calls == 1
+    assert queue.metrics()["queue_depth"] == 0
+
+
+def test_stop_reports_a_failed_final_save():
+    writer = FlakyWriter()
+    queue = storage.WriteBehindQueue(writer, max_delay_sec=60)
+    queue.start()
+    queue.enqueue()
+    writer.fail = True
+
+    assert queue.stop() is False
+
+
+def test_strict_mode_raises_on_failed_save():
+    writer = FlakyWriter()
+    writer.fail = True
+    queue = storage.WriteBehindQueue(writer, strict=True)
+    queue.start()
+
+    with pytest.raises(OSError):
+        queue.enqueue()
+    assert queue.metrics()["flush_count"] == 0
+    assert queue.metrics()["failed_flush_count"] == 1
+
+
+def test_strict_mode_saves_before_returning():
+    writer = FlakyWriter()
+    queue = storage.WriteBehindQueue(writer, strict=True)
+    queue.start()
+    queue.enqueue()
+    assert writer.calls == 1